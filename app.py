@@ -1,13 +1,29 @@
 import os
-import re
-import io
-import html
-import wave
-import requests
-from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
-from deepgram import DeepgramClient
+
+from pronchk import core
+from pronchk.core import (
+    practice_items_from_mismatches,
+    render_highlighted_reference,
+    wav_downmix_to_mono16,
+    wav_duration_seconds,
+    wav_rate_variants,
+)
+
+# requests is imported lazily inside the cached session factory below:
+# Streamlit re-executes this module on every rerun, and the initial
+# paste-text/record UI doesn't need it.
+
+try:
+    import xxhash
+
+    # SIMD-accelerated keying for the multi-MB recording passed to transcribe;
+    # Streamlit's default bytes hashing is noticeably slower at that size.
+    _BYTES_HASH_FUNCS = {bytes: xxhash.xxh3_64_intdigest}
+except ImportError:
+    _BYTES_HASH_FUNCS = {}
 
 # ----------------------------
 # Config (hardcoded)
@@ -23,6 +39,7 @@ MAX_SECONDS = 60
 MAX_PRACTICE_ITEMS = 12
 SLOW_FACTOR = 0.75   # 0.75x speed (lower pitch too, but clearer for learners)
 FAST_FACTOR = 1.20   # 1.2x speed
+TTS_PREFETCH_WORKERS = 8
 
 
 # ----------------------------
@@ -36,128 +53,76 @@ def get_api_key() -> str:
 
 
 # ----------------------------
-# Helpers: WAV duration
-# ----------------------------
-def wav_duration_seconds(wav_bytes: bytes) -> float:
-    try:
-        with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-            frames = wf.getnframes()
-            rate = wf.getframerate()
-            if rate <= 0:
-                return 0.0
-            return frames / float(rate)
-    except wave.Error:
-        return -1.0
-
-
-# ----------------------------
-# Helpers: normalization/tokenization
-# ----------------------------
-NUM_WORDS = {
-    "zero","one","two","three","four","five","six","seven","eight","nine","ten",
-    "eleven","twelve","thirteen","fourteen","fifteen","sixteen","seventeen","eighteen","nineteen",
-    "twenty","thirty","forty","fifty","sixty","seventy","eighty","ninety",
-    "hundred","thousand","million","billion"
-}
-
-def normalize_text_for_scoring(text: str) -> str:
-    text = text.lower()
-    text = re.sub(r"\b\d+(?:[.,]\d+)?\b", "<num>", text)
-    tokens = re.findall(r"[a-z']+|<num>", text)
-    out = []
-    for t in tokens:
-        out.append("<num>" if t in NUM_WORDS else t)
-    return " ".join(out)
-
-def tokenize(text: str) -> list[str]:
-    return normalize_text_for_scoring(text).split()
-
-
-# ----------------------------
-# Alignment + highlighting
+# Scoring (pure logic lives in pronchk.core; cached per rerun here)
 # ----------------------------
-def align_words(ref_tokens: list[str], hyp_tokens: list[str]):
-    sm = SequenceMatcher(a=ref_tokens, b=hyp_tokens)
-    return sm.get_opcodes()
-
+@st.cache_data(max_entries=32)
 def score_and_mismatches(ref_text: str, hyp_text: str):
-    ref_tokens = tokenize(ref_text)
-    hyp_tokens = tokenize(hyp_text)
-
-    if not ref_tokens:
-        return 0.0, [], ref_tokens, hyp_tokens, []
-
-    ops = align_words(ref_tokens, hyp_tokens)
-
-    matched = 0
-    mismatches = []
-    ref_marks = ["ok"] * len(ref_tokens)
-
-    for tag, i1, i2, j1, j2 in ops:
-        if tag == "equal":
-            matched += (i2 - i1)
-        elif tag == "replace":
-            for k in range(i1, i2):
-                if 0 <= k < len(ref_marks):
-                    ref_marks[k] = "bad"
-            mismatches.append({"type": "replace", "ref": " ".join(ref_tokens[i1:i2]), "hyp": " ".join(hyp_tokens[j1:j2])})
-        elif tag == "delete":
-            for k in range(i1, i2):
-                if 0 <= k < len(ref_marks):
-                    ref_marks[k] = "bad"
-            mismatches.append({"type": "delete", "ref": " ".join(ref_tokens[i1:i2]), "hyp": "(missing)"})
-        elif tag == "insert":
-            mismatches.append({"type": "insert", "ref": "(extra)", "hyp": " ".join(hyp_tokens[j1:j2])})
-
-    score = 100.0 * matched / max(1, len(ref_tokens))
-    return score, mismatches, ref_tokens, hyp_tokens, ref_marks
-
-def render_highlighted_reference(ref_tokens: list[str], ref_marks: list[str]) -> str:
-    chunks = []
-    for tok, mark in zip(ref_tokens, ref_marks):
-        safe = html.escape(tok)
-        if mark == "bad":
-            chunks.append(
-                f"<span style='background:#ffebee; color:#b71c1c; padding:2px 4px; border-radius:6px; margin:1px; display:inline-block;'>{safe}</span>"
-            )
-        else:
-            chunks.append(
-                f"<span style='background:#e8f5e9; color:#1b5e20; padding:2px 4px; border-radius:6px; margin:1px; display:inline-block;'>{safe}</span>"
-            )
-    return " ".join(chunks)
+    return core.score_and_mismatches(ref_text, hyp_text)
 
 
 # ----------------------------
 # STT: transcription (pre-recorded)
 # ----------------------------
-def transcribe(audio_bytes: bytes) -> str:
-    api_key = get_api_key()
-    client = DeepgramClient(api_key=api_key)
-
-    response = client.listen.v1.media.transcribe_file(
-        request=audio_bytes,
-        model=STT_MODEL,
-        language=STT_LANGUAGE,
-        smart_format=True,
-        punctuate=True,
+@st.cache_data(show_spinner=False, hash_funcs=_BYTES_HASH_FUNCS)
+def transcribe(audio_bytes: bytes, language: str, model: str) -> str:
+    # No defaults on purpose: st.cache_data only hashes arguments the caller
+    # actually passes, so defaulted values would never enter the cache key and
+    # changing them would serve stale transcripts.
+    # POST the raw WAV straight to the REST endpoint over the pooled session:
+    # no SDK request wrapping/rebuffering, and the same kept-alive connection
+    # the TTS calls use.
+    r = _deepgram_session().post(
+        "https://api.deepgram.com/v1/listen",
+        params={
+            "model": model,
+            "language": language,
+            "smart_format": "true",
+            "punctuate": "true",
+        },
+        headers={"Content-Type": "audio/wav"},
+        data=audio_bytes,
+        timeout=60,
     )
-    return response.results.channels[0].alternatives[0].transcript or ""
+    r.raise_for_status()
+    results = r.json()["results"]
+    return results["channels"][0]["alternatives"][0]["transcript"] or ""
 
 
 # ----------------------------
 # TTS: speak request -> WAV bytes
 # ----------------------------
-@st.cache_data(show_spinner=False)
-def tts_wav_bytes(text: str, voice_model: str = TTS_VOICE_MODEL) -> bytes:
+@st.cache_resource
+def _deepgram_session():
+    # One pooled session per worker: keep-alive connections to api.deepgram.com
+    # skip the TCP+TLS handshake on every practice phrase after the first.
+    import requests
+
+    s = requests.Session()
+    s.headers.update({
+        "Authorization": f"Token {get_api_key()}",
+        "Content-Type": "application/json",
+    })
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    s.mount("https://", adapter)
+    return s
+
+
+@st.cache_resource
+def _tts_pool() -> ThreadPoolExecutor:
+    # Shared executor so synthesis can be kicked off early and overlap the
+    # score/highlight rendering below instead of starting after it.
+    return ThreadPoolExecutor(max_workers=TTS_PREFETCH_WORKERS)
+
+
+@st.cache_data(show_spinner=False, persist="disk", max_entries=2000)
+def tts_wav_bytes(text: str, voice_model: str) -> bytes:
     """
     One TTS call per phrase. We return WAV linear16 @16k for easy speed variants.
+    Persisted on disk so repeat phrases skip Deepgram entirely across sessions.
+    voice_model has no default so it always enters the cache key (see
+    transcribe above).
     """
-    api_key = get_api_key()
     url = "https://api.deepgram.com/v1/speak"
-    headers = {
-        "Authorization": f"Token {api_key}",
-        "Content-Type": "application/json",
-    }
     params = {
         "model": voice_model,
         "container": "wav",
@@ -166,58 +131,11 @@ def tts_wav_bytes(text: str, voice_model: str = TTS_VOICE_MODEL) -> bytes:
     }
     payload = {"text": text}
 
-    r = requests.post(url, headers=headers, params=params, json=payload, timeout=60)
+    r = _deepgram_session().post(url, params=params, json=payload, timeout=60)
     r.raise_for_status()
     return r.content
 
 
-# ----------------------------
-# Audio: create slow/fast variants by changing WAV playback rate
-# (simple & cheap; pitch changes slightly but clarity is good for learners)
-# ----------------------------
-def wav_change_playback_rate(wav_bytes: bytes, rate_multiplier: float) -> bytes:
-    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-        nchannels = wf.getnchannels()
-        sampwidth = wf.getsampwidth()
-        framerate = wf.getframerate()
-        nframes = wf.getnframes()
-        frames = wf.readframes(nframes)
-
-    new_rate = max(8000, int(framerate * rate_multiplier))
-
-    out = io.BytesIO()
-    with wave.open(out, "wb") as ww:
-        ww.setnchannels(nchannels)
-        ww.setsampwidth(sampwidth)
-        ww.setframerate(new_rate)
-        ww.writeframes(frames)
-
-    return out.getvalue()
-
-
-# ----------------------------
-# Practice item selection
-# ----------------------------
-def practice_items_from_mismatches(mismatches: list[dict], max_items: int = MAX_PRACTICE_ITEMS) -> list[str]:
-    out = []
-    seen = set()
-    for m in mismatches:
-        ref = (m.get("ref") or "").strip()
-        if not ref or ref in {"(extra)"}:
-            continue
-
-        # Make <num> pronounceable
-        ref = ref.replace("<num>", "number")
-
-        if ref in seen:
-            continue
-        seen.add(ref)
-        out.append(ref)
-        if len(out) >= max_items:
-            break
-    return out
-
-
 # ----------------------------
 # Session state + "New session"
 # ----------------------------
@@ -229,10 +147,11 @@ if "last" not in st.session_state:
     st.session_state.last = None
 
 def reset_session():
+    # Only reset the session widgets/results; keep the persisted TTS cache so
+    # previously synthesized phrases stay free across sessions.
     st.session_state.last = None
     st.session_state.ref_key += 1
     st.session_state.audio_key += 1
-    st.cache_data.clear()
 
 def clear_query_params():
     # Works across Streamlit versions
@@ -296,6 +215,16 @@ div.block-container { padding-top: 4.25rem; }
 #sticky-topbar a.ns-btn:hover {
   background: rgba(255,255,255,0.12);
 }
+
+.tok-ok {
+  background:#e8f5e9; color:#1b5e20;
+  padding:2px 4px; border-radius:6px; margin:1px; display:inline-block;
+}
+
+.tok-bad {
+  background:#ffebee; color:#b71c1c;
+  padding:2px 4px; border-radius:6px; margin:1px; display:inline-block;
+}
 </style>
 
 <div id="sticky-topbar">
@@ -327,12 +256,13 @@ audio_file = st.audio_input(
     key=f"audio_{st.session_state.audio_key}",
 )
 
-audio_bytes = None
+audio_buf = None
 if audio_file is not None:
-    audio_bytes = audio_file.getvalue()
-    st.audio(audio_bytes, format="audio/wav")
+    # Zero-copy view; real bytes are only materialized at the transcribe call.
+    audio_buf = audio_file.getbuffer()
+    st.audio(audio_file, format="audio/wav")
 
-    dur = wav_duration_seconds(audio_bytes)
+    dur = wav_duration_seconds(audio_buf)
     if dur >= 0:
         st.info(f"Detected duration: **{dur:.1f}s** (target ≤ {MAX_SECONDS}s).")
         if dur > MAX_SECONDS:
@@ -346,13 +276,13 @@ if score_btn:
     if not ref_text.strip():
         st.error("Please paste the original text first.")
         st.stop()
-    if audio_bytes is None:
+    if audio_buf is None:
         st.error("Please record audio first.")
         st.stop()
 
     with st.spinner("Analyzing…"):
         try:
-            transcript = transcribe(audio_bytes)
+            transcript = transcribe(wav_downmix_to_mono16(bytes(audio_buf)), STT_LANGUAGE, STT_MODEL)
         except Exception as e:
             st.error(f"Transcription failed: {e}")
             st.stop()
@@ -361,26 +291,45 @@ if score_btn:
     st.session_state.last = {
         "score": score,
         "mismatches": mismatches,
-        "ref_tokens": ref_tokens,
-        "ref_marks": ref_marks,
+        # Rendered once here; reruns just replay the stored HTML instead of
+        # re-escaping and re-joining every token.
+        "highlight_html": render_highlighted_reference(ref_tokens, ref_marks),
     }
 
 # Render results (if any)
 if st.session_state.last is not None:
     score = st.session_state.last["score"]
     mismatches = st.session_state.last["mismatches"]
-    ref_tokens = st.session_state.last["ref_tokens"]
-    ref_marks = st.session_state.last["ref_marks"]
+    highlight_html = st.session_state.last["highlight_html"]
+
+    # Start TTS for the practice phrases immediately: the network round-trips
+    # run while the score, highlights, and mismatch list render below.
+    items = practice_items_from_mismatches(mismatches, max_items=MAX_PRACTICE_ITEMS)
+    tts_futures = {
+        phrase: _tts_pool().submit(tts_wav_bytes, phrase, TTS_VOICE_MODEL) for phrase in items
+    }
 
     st.subheader("Pronunciation score")
     st.metric("Pronunciation score", f"{score:.1f} / 100")
 
     st.subheader("Reference text with highlighted issues")
-    st.markdown(render_highlighted_reference(ref_tokens, ref_marks), unsafe_allow_html=True)
+    st.markdown(highlight_html, unsafe_allow_html=True)
 
     if mismatches:
+        # One markdown element for the whole list (not one element per item);
+        # the collapsed expander defers DOM cost until the user opens it.
+        with st.expander(f"Mismatch details ({len(mismatches)})"):
+            st.markdown(
+                "\n".join(
+                    f"- **{m['type'].upper()}** — expected `{m['ref']}` | heard `{m['hyp']}`"
+                    for m in mismatches[:50]
+                )
+            )
+            if len(mismatches) > 50:
+                st.caption(f"Showing the first 50 of {len(mismatches)} mismatches.")
+
+
         st.subheader("Practice audio (normal / slow / fast)")
-        items = practice_items_from_mismatches(mismatches, max_items=MAX_PRACTICE_ITEMS)
 
         h1, h2, h3, h4 = st.columns([2.2, 1.4, 1.4, 1.4])
         h1.markdown("**Word / phrase**")
@@ -391,9 +340,8 @@ if st.session_state.last is not None:
         for phrase in items:
             # Generate ONE normal TTS WAV, then derive slow/fast locally
             try:
-                normal_wav = tts_wav_bytes(phrase)
-                slow_wav = wav_change_playback_rate(normal_wav, SLOW_FACTOR)
-                fast_wav = wav_change_playback_rate(normal_wav, FAST_FACTOR)
+                normal_wav = tts_futures[phrase].result()
+                slow_wav, fast_wav = wav_rate_variants(normal_wav, SLOW_FACTOR, FAST_FACTOR)
 
                 c1, c2, c3, c4 = st.columns([2.2, 1.4, 1.4, 1.4])
                 c1.write(phrase)
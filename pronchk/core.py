@@ -0,0 +1,286 @@
+"""
+Pure helpers for the pronunciation checker: normalization, tokenization,
+alignment/scoring, highlight rendering, and WAV utilities.
+
+Streamlit re-executes app.py on every rerun; keeping these here means reruns
+re-import a bytecode-cached module instead of re-compiling the definitions.
+Nothing in this module may import streamlit.
+"""
+
+import re
+import io
+import html
+import wave
+import struct
+import functools
+
+import numpy as np
+
+from difflib import SequenceMatcher
+
+try:
+    from rapidfuzz.distance import Levenshtein as _Levenshtein
+except ImportError:  # pure-Python fallback
+    _Levenshtein = None
+
+
+# ----------------------------
+# WAV helpers
+# ----------------------------
+def wav_duration_seconds(wav_bytes: bytes | memoryview) -> float:
+    # Walk the RIFF chunk descriptors directly instead of handing the whole
+    # recording to the wave module: a handful of header reads instead of
+    # scanning ~2 MB of payload. Handles non-canonical layouts (extra chunks
+    # before "data") too, so no wave-module fallback is needed.
+    if len(wav_bytes) < 12 or wav_bytes[:4] != b"RIFF" or wav_bytes[8:12] != b"WAVE":
+        return -1.0
+
+    byte_rate = 0
+    pos = 12
+    n = len(wav_bytes)
+    while pos + 8 <= n:
+        chunk_id = bytes(wav_bytes[pos:pos + 4])
+        size = struct.unpack_from("<I", wav_bytes, pos + 4)[0]
+        if chunk_id == b"fmt " and pos + 20 <= n:
+            byte_rate = struct.unpack_from("<I", wav_bytes, pos + 16)[0]
+        elif chunk_id == b"data":
+            if byte_rate <= 0:
+                return 0.0
+            data_size = min(size, n - pos - 8)  # guard against short files
+            return data_size / float(byte_rate)
+        pos += 8 + size + (size & 1)  # sub-chunks are word-aligned
+    return -1.0
+
+
+def wav_change_playback_rate(wav_bytes: bytes, rate_multiplier: float) -> bytes:
+    # Canonical header (what Deepgram's wav/linear16 container produces):
+    # just patch the sample-rate and byte-rate fields and reuse the PCM payload
+    # as-is, instead of decoding and re-encoding megabytes of frames.
+    if (
+        len(wav_bytes) >= 44
+        and wav_bytes[:4] == b"RIFF"
+        and wav_bytes[8:12] == b"WAVE"
+        and wav_bytes[12:16] == b"fmt "
+    ):
+        channels = struct.unpack_from("<H", wav_bytes, 22)[0]
+        framerate = struct.unpack_from("<I", wav_bytes, 24)[0]
+        sampwidth = struct.unpack_from("<H", wav_bytes, 34)[0] // 8
+        new_rate = max(8000, int(framerate * rate_multiplier))
+        return b"".join((
+            wav_bytes[:24],
+            struct.pack("<II", new_rate, new_rate * channels * sampwidth),
+            wav_bytes[32:],
+        ))
+
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        nchannels = wf.getnchannels()
+        sampwidth = wf.getsampwidth()
+        framerate = wf.getframerate()
+        nframes = wf.getnframes()
+        frames = wf.readframes(nframes)
+
+    new_rate = max(8000, int(framerate * rate_multiplier))
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as ww:
+        ww.setnchannels(nchannels)
+        ww.setsampwidth(sampwidth)
+        ww.setframerate(new_rate)
+        ww.writeframes(frames)
+
+    return out.getvalue()
+
+
+def wav_downmix_to_mono16(wav_bytes: bytes) -> bytes:
+    """
+    Downmix stereo 16-bit PCM to mono so the transcription upload carries half
+    the bytes. Returns the input unchanged when it is already mono (the usual
+    case for st.audio_input) or when the layout isn't plain 16-bit PCM.
+    """
+    if len(wav_bytes) < 12 or wav_bytes[:4] != b"RIFF" or wav_bytes[8:12] != b"WAVE":
+        return wav_bytes
+
+    channels = bits = rate = 0
+    pos = 12
+    n = len(wav_bytes)
+    while pos + 8 <= n:
+        chunk_id = wav_bytes[pos:pos + 4]
+        size = struct.unpack_from("<I", wav_bytes, pos + 4)[0]
+        if chunk_id == b"fmt " and pos + 24 <= n:
+            channels = struct.unpack_from("<H", wav_bytes, pos + 10)[0]
+            rate = struct.unpack_from("<I", wav_bytes, pos + 12)[0]
+            bits = struct.unpack_from("<H", wav_bytes, pos + 22)[0]
+        elif chunk_id == b"data":
+            if channels != 2 or bits != 16 or rate <= 0:
+                return wav_bytes
+            data = wav_bytes[pos + 8:pos + 8 + min(size, n - pos - 8)]
+            frames = np.frombuffer(data[:len(data) - len(data) % 4], dtype="<i2")
+            mono = frames.reshape(-1, 2).mean(axis=1).astype(np.int16)
+            out = io.BytesIO()
+            with wave.open(out, "wb") as ww:
+                ww.setnchannels(1)
+                ww.setsampwidth(2)
+                ww.setframerate(rate)
+                ww.writeframes(mono.tobytes())
+            return out.getvalue()
+        pos += 8 + size + (size & 1)  # sub-chunks are word-aligned
+    return wav_bytes
+
+
+def wav_rate_variants(wav_bytes: bytes, *multipliers: float) -> tuple[bytes, ...]:
+    """
+    Emit one retuned copy per multiplier from a single header parse, sharing
+    the header/payload slices across all variants.
+    """
+    if (
+        len(wav_bytes) >= 44
+        and wav_bytes[:4] == b"RIFF"
+        and wav_bytes[8:12] == b"WAVE"
+        and wav_bytes[12:16] == b"fmt "
+    ):
+        channels = struct.unpack_from("<H", wav_bytes, 22)[0]
+        framerate = struct.unpack_from("<I", wav_bytes, 24)[0]
+        sampwidth = struct.unpack_from("<H", wav_bytes, 34)[0] // 8
+        head, tail = wav_bytes[:24], wav_bytes[32:]
+        return tuple(
+            b"".join((
+                head,
+                struct.pack("<II", rate, rate * channels * sampwidth),
+                tail,
+            ))
+            for rate in (max(8000, int(framerate * m)) for m in multipliers)
+        )
+    return tuple(wav_change_playback_rate(wav_bytes, m) for m in multipliers)
+
+
+# ----------------------------
+# Normalization/tokenization
+# ----------------------------
+NUM_WORDS = frozenset({
+    "zero","one","two","three","four","five","six","seven","eight","nine","ten",
+    "eleven","twelve","thirteen","fourteen","fifteen","sixteen","seventeen","eighteen","nineteen",
+    "twenty","thirty","forty","fifty","sixty","seventy","eighty","ninety",
+    "hundred","thousand","million","billion"
+})
+
+# One pass over the text: group 1 matches a standalone number, group 2 a word
+# token. Word tokens in NUM_WORDS collapse to <num> like the numbers do.
+_TOKEN_RE = re.compile(r"(\b\d+(?:[.,]\d+)?\b)|([a-z']+)")
+
+@functools.lru_cache(maxsize=256)
+def _tokens(text: str) -> tuple[str, ...]:
+    return tuple(
+        "<num>" if m.group(2) is None or m.group(2) in NUM_WORDS else m.group(2)
+        for m in _TOKEN_RE.finditer(text.lower())
+    )
+
+def normalize_text_for_scoring(text: str) -> str:
+    return " ".join(_tokens(text))
+
+def tokenize(text: str) -> list[str]:
+    return list(_tokens(text))
+
+
+# ----------------------------
+# Alignment + scoring
+# ----------------------------
+def align_words(ref_tokens: list[str], hyp_tokens: list[str]):
+    # Intern tokens to small ints shared across both sequences so the aligner
+    # hashes/compares machine words instead of variable-length strings. The
+    # opcode indices still index the original token lists unchanged.
+    vocab: dict[str, int] = {}
+    ref_ids = [vocab.setdefault(t, len(vocab)) for t in ref_tokens]
+    hyp_ids = [vocab.setdefault(t, len(vocab)) for t in hyp_tokens]
+
+    if _Levenshtein is not None:
+        # C++ implementation; emits the same (tag, i1, i2, j1, j2) opcodes.
+        return [
+            (op.tag, op.src_start, op.src_end, op.dest_start, op.dest_end)
+            for op in _Levenshtein.opcodes(ref_ids, hyp_ids)
+        ]
+    sm = SequenceMatcher(a=ref_ids, b=hyp_ids)
+    return sm.get_opcodes()
+
+def score_and_mismatches(ref_text: str, hyp_text: str):
+    ref_tokens = tokenize(ref_text)
+    hyp_tokens = tokenize(hyp_text)
+
+    if not ref_tokens:
+        return 0.0, [], ref_tokens, hyp_tokens, np.zeros(0, np.uint8)
+
+    # Perfect read: a list equality check beats running the aligner.
+    if ref_tokens == hyp_tokens:
+        return 100.0, [], ref_tokens, hyp_tokens, np.zeros(len(ref_tokens), np.uint8)
+
+    ops = align_words(ref_tokens, hyp_tokens)
+
+    matched = 0
+    mismatches = []
+    ref_marks = np.zeros(len(ref_tokens), np.uint8)  # 0 = ok, 1 = bad
+
+    for tag, i1, i2, j1, j2 in ops:
+        if tag == "equal":
+            matched += (i2 - i1)
+        elif tag == "replace":
+            ref_marks[i1:i2] = 1
+            mismatches.append({"type": "replace", "ref": " ".join(ref_tokens[i1:i2]), "hyp": " ".join(hyp_tokens[j1:j2])})
+        elif tag == "delete":
+            ref_marks[i1:i2] = 1
+            mismatches.append({"type": "delete", "ref": " ".join(ref_tokens[i1:i2]), "hyp": "(missing)"})
+        elif tag == "insert":
+            mismatches.append({"type": "insert", "ref": "(extra)", "hyp": " ".join(hyp_tokens[j1:j2])})
+
+    score = 100.0 * matched / max(1, len(ref_tokens))
+    return score, mismatches, ref_tokens, hyp_tokens, ref_marks
+
+
+def score_only(ref_text: str, hyp_text: str) -> float:
+    """
+    Just the score, for callers that don't render: skips allocating the mark
+    array and the mismatch dicts.
+    """
+    ref_tokens = tokenize(ref_text)
+    hyp_tokens = tokenize(hyp_text)
+
+    if not ref_tokens:
+        return 0.0
+    if ref_tokens == hyp_tokens:
+        return 100.0
+
+    matched = sum(
+        i2 - i1
+        for tag, i1, i2, _j1, _j2 in align_words(ref_tokens, hyp_tokens)
+        if tag == "equal"
+    )
+    return 100.0 * matched / len(ref_tokens)
+
+
+# ----------------------------
+# Highlight rendering
+# ----------------------------
+_ESCAPE_NEEDED = re.compile(r"[&<>\"']").search
+_OK_TPL = '<span class="tok-ok">{}</span>'
+_BAD_TPL = '<span class="tok-bad">{}</span>'
+
+def render_highlighted_reference(ref_tokens: list[str], ref_marks: np.ndarray) -> str:
+    # Styles live in the .tok-ok/.tok-bad classes injected with the page CSS,
+    # so each token is a short span instead of repeating the full inline style.
+    # Normalized tokens are [a-z']+ or <num>, so most need no escaping at all.
+    return " ".join(
+        (_BAD_TPL if mark else _OK_TPL).format(
+            html.escape(tok) if _ESCAPE_NEEDED(tok) else tok
+        )
+        for tok, mark in zip(ref_tokens, ref_marks)
+    )
+
+
+# ----------------------------
+# Practice item selection
+# ----------------------------
+_SKIP_REFS = frozenset({"", "(extra)"})
+
+def practice_items_from_mismatches(mismatches: list[dict], max_items: int = 12) -> list[str]:
+    # dict.fromkeys dedups in one C-level pass while keeping first-seen order;
+    # "<num>" becomes pronounceable before synthesis.
+    refs = ((m.get("ref") or "").strip().replace("<num>", "number") for m in mismatches)
+    return list(dict.fromkeys(r for r in refs if r not in _SKIP_REFS))[:max_items]